@@ -1,35 +1,148 @@
 import os
 import json
+import time
+import gzip
 import ccxt
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import boto3
-from io import StringIO
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from io import BytesIO
 from datetime import datetime
 from gremlin_python.driver import client, serializer
 
 # Configuración
 NEPTUNE_ENDPOINT = os.environ.get('NEPTUNE_ENDPOINT')
+
+# Queries Gremlin constantes con bindings: al no interpolar valores en el
+# texto, Neptune cachea el plan compilado y lo reutiliza en cada submit
+# (y de paso eliminamos el riesgo de inyección vía nombres de símbolo).
+# Cada query procesa un LOTE completo inyectado como lista de mapas, así que
+# un round-trip cubre hasta NEPTUNE_BATCH_SIZE objetos en vez de uno.
+NEPTUNE_BATCH_SIZE = 50
+
+# OJO: has(key, traversal) NO compara valores (es un filtro de existencia),
+# así que el matching contra el mapa inyectado se hace con where(eq('m'))
+# comparando el 'symbol' del vértice con la entrada correspondiente del mapa.
+VERTEX_UPSERT_QUERY = """
+g.inject(batch).unfold().as('m')
+ .coalesce(
+    V().hasLabel('coin').as('v').where('v', eq('m')).by('symbol').by(select('sym')),
+    addV('coin').property('symbol', select('m').select('sym'))
+ )
+ .property('volatility', select('m').select('vol'))
+ .property('volume_ratio', select('m').select('vr'))
+ .property('last_seen', select('m').select('ts'))
+"""
+
+# Upsert de arista en una sola query: si la relación ya existe se actualiza
+# en sitio (antes hacíamos drop + add, dos round-trips por arista).
+EDGE_UPSERT_QUERY = """
+g.inject(batch).unfold().as('m')
+ .V().hasLabel('coin').as('a').where('a', eq('m')).by('symbol').by(select('leader'))
+ .V().hasLabel('coin').as('b').where('b', eq('m')).by('symbol').by(select('follower'))
+ .coalesce(
+    select('a').outE('leads').where(inV().where(eq('b'))),
+    addE('leads').from('a').to('b')
+ )
+ .property('correlation', select('m').select('corr'))
+ .property('lag', select('m').select('lag'))
+ .property('updated_at', select('m').select('ts'))
+"""
+
+def _batches(items, size=NEPTUNE_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 S3_BUCKET = os.environ.get('S3_BUCKET')
 CSV_FILENAME = "market_leaders_history.csv"
 TIMEFRAME = '1m'
-LIMIT = 1000 
+LIMIT = 1000
+
+# Cliente a nivel de módulo: Lambda reutiliza el contexto entre invocaciones
+# calientes, así que conservamos la sesión HTTP y los mercados ya cargados.
+exchange = ccxt.binance({
+    'timeout': 30000,
+    'enableRateLimit': True
+})
+
+# Igual con S3 y Neptune: crear el cliente (y sobre todo el handshake TLS +
+# WebSocket de Neptune) en cada invocación tira cientos de ms. Los contenedores
+# calientes reutilizan estas conexiones; si Neptune falla se resetea y se
+# reabre en la siguiente llamada.
+s3 = boto3.client('s3', config=Config(
+    max_pool_connections=10,
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=10,
+    retries={'mode': 'adaptive', 'max_attempts': 5}
+))
+
+_g_client = None
+
+def get_gremlin_client():
+    global _g_client
+    if _g_client is None:
+        _g_client = client.Client(f'wss://{NEPTUNE_ENDPOINT}:8182/gremlin', 'g')
+    return _g_client
+
+def reset_gremlin_client():
+    global _g_client
+    try:
+        if _g_client:
+            _g_client.close()
+    except Exception:
+        pass
+    _g_client = None
+
+# La lista de pares USDC apenas cambia: la cacheamos en memoria y en /tmp
+# (sobrevive al contenedor caliente) para ahorrar el load_markets de ~1-3s.
+SYMBOLS_CACHE_FILE = '/tmp/usdc_symbols.json'
+SYMBOLS_CACHE_TTL = 3600
+_symbols_cache = {'ts': 0, 'symbols': None}
+
+def get_usdc_symbols():
+    now = time.time()
+
+    # 1. Cache en memoria del contenedor
+    if _symbols_cache['symbols'] and now - _symbols_cache['ts'] < SYMBOLS_CACHE_TTL:
+        return _symbols_cache['symbols']
+
+    # 2. Cache en /tmp (por si el módulo se reimportó en el mismo contenedor)
+    try:
+        if os.path.exists(SYMBOLS_CACHE_FILE):
+            with open(SYMBOLS_CACHE_FILE) as f:
+                cached = json.load(f)
+            if now - cached['ts'] < SYMBOLS_CACHE_TTL:
+                _symbols_cache.update(cached)
+                return cached['symbols']
+    except Exception as e:
+        print(f"Aviso leyendo cache de símbolos: {e}")
+
+    # 3. Red: descarga completa de mercados
+    markets = exchange.load_markets()
+    symbols = [s for s in markets if s.endswith('/USDC')]
+
+    _symbols_cache['ts'] = now
+    _symbols_cache['symbols'] = symbols
+    try:
+        with open(SYMBOLS_CACHE_FILE, 'w') as f:
+            json.dump(_symbols_cache, f)
+    except Exception as e:
+        print(f"Aviso escribiendo cache de símbolos: {e}")
+
+    return symbols
 
 def get_binance_data():
     print("Iniciando conexión con Binance...")
-    exchange = ccxt.binance({
-        'timeout': 30000, 
-        'enableRateLimit': True
-    })
-    
+
     try:
-        markets = exchange.load_markets()
+        # Pares USDC (cacheados entre invocaciones calientes)
+        symbols = get_usdc_symbols()
     except Exception as e:
         print(f"ERROR CRÍTICO cargando mercados: {e}")
         return pd.DataFrame(), {}
-
-    # Filtramos pares USDC
-    symbols = [s for s in markets if s.endswith('/USDC')]
     # Aumentamos un poco el límite para tener mejor visión de mercado
     selected_symbols = symbols[:60] 
     
@@ -38,84 +151,150 @@ def get_binance_data():
     metadata = {}
     
     print(f"Descargando datos para: {len(selected_symbols)} activos")
-    
-    for sym in selected_symbols:
+
+    # Descarga CONCURRENTE: cada fetch_ohlcv es ~100-500ms de red con la CPU
+    # parada. Lanzamos las peticiones en paralelo y procesamos al llegar.
+    def _fetch(sym):
+        try:
+            return sym, exchange.fetch_ohlcv(sym, timeframe=TIMEFRAME, limit=LIMIT)
+        except Exception as e:
+            print(f"Error descargando {sym}: {e}")
+            return sym, None
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        downloads = list(executor.map(_fetch, selected_symbols))
+
+    for sym, ohlcv in downloads:
         try:
-            # Traemos velas
-            ohlcv = exchange.fetch_ohlcv(sym, timeframe=TIMEFRAME, limit=LIMIT)
             if not ohlcv: continue
-                
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df.set_index('timestamp', inplace=True)
-            
+
+            # Solo usamos timestamp, close y volume: leerlos directamente del
+            # array evita construir un DataFrame de 6 columnas por símbolo
+            # para descartar open/high/low al momento.
+            arr = np.asarray(ohlcv, dtype=np.float64)
+            index = pd.DatetimeIndex(arr[:, 0].astype('datetime64[ms]'))
+
             # Limpieza básica
-            df = df[~df.index.duplicated(keep='first')]
-            
+            keep = ~index.duplicated(keep='first')
+            index = index[keep]
+            close = arr[keep, 4]
+            volume = arr[keep, 5]
+
             coin_name = sym.split('/')[0]
-            close_data[coin_name] = df['close']
-            
-            # --- NUEVO: CÁLCULO DE MÉTRICAS INDIVIDUALES ---
-            # 1. Volatilidad (Desviación estándar de los retornos logarítmicos de los últimos 60 min)
-            df['log_ret'] = np.log(df['close'] / df['close'].shift(1))
-            volatility = df['log_ret'].tail(60).std() * 100 # Porcentaje
-            
-            # 2. Volumen Relativo (Volumen actual vs Promedio 20 periodos)
-            avg_vol = df['volume'].rolling(20).mean().iloc[-1]
-            cur_vol = df['volume'].iloc[-1]
-            vol_ratio = round(cur_vol / avg_vol, 2) if avg_vol > 0 else 0
-            
-            metadata[coin_name] = {
-                'volatility': float(volatility) if not pd.isna(volatility) else 0.0,
-                'volume_ratio': float(vol_ratio)
-            }
-            
+            close_data[coin_name] = pd.Series(close, index=index, name=coin_name)
+            volume_data[coin_name] = pd.Series(volume, index=index, name=coin_name)
+
         except Exception as e:
             print(f"Error en {sym}: {e}")
             
     if not close_data: return pd.DataFrame(), {}
 
-    full_df = pd.DataFrame(close_data)
-    full_df = full_df.ffill().dropna()
-    
+    # Alineamos todas las series en una pasada vectorizada: pd.concat hace el
+    # outer-join de índices de golpe, en vez del reindex columna a columna
+    # que implica construir el DataFrame desde el dict.
+    full_df = pd.concat(list(close_data.values()), axis=1, join='outer')
+    full_df = full_df.ffill()
+
+    # Tras el ffill los únicos NaN posibles son un prefijo contiguo (columnas
+    # que empiezan más tarde). Cortamos desde la primera fila completa en vez
+    # de pagar el escaneo + copia de dropna() sobre todo el frame.
+    valid = ~np.isnan(full_df.to_numpy()).any(axis=1)
+    if valid.any():
+        full_df = full_df.iloc[int(valid.argmax()):]
+    else:
+        return pd.DataFrame(), {}
+
+    # --- CÁLCULO DE MÉTRICAS INDIVIDUALES (VECTORIZADO) ---
+    # Antes cada símbolo calculaba su volatilidad y ratio de volumen en el
+    # bucle de descarga; sobre la matriz apilada sale en una pasada por métrica.
+    closes = full_df.to_numpy()
+
+    # 1. Volatilidad (Desviación estándar de los retornos logarítmicos de los últimos 60 min)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_ret = np.log(closes[1:] / closes[:-1])
+        volatility = log_ret[-60:].std(axis=0, ddof=1) * 100 # Porcentaje
+
+        # 2. Volumen Relativo (Volumen actual vs Promedio 20 periodos)
+        vols = pd.concat(list(volume_data.values()), axis=1, join='outer') \
+                 .reindex(full_df.index).to_numpy()
+        avg_vol = vols[-20:].mean(axis=0)
+        vol_ratio = np.where(avg_vol > 0, np.round(vols[-1] / avg_vol, 2), 0.0)
+
+    for i, coin_name in enumerate(full_df.columns):
+        metadata[coin_name] = {
+            'volatility': float(volatility[i]) if not np.isnan(volatility[i]) else 0.0,
+            'volume_ratio': float(vol_ratio[i]) if not np.isnan(vol_ratio[i]) else 0.0
+        }
+
     return full_df, metadata
 
+# Memoización entre invocaciones calientes: si la ventana descargada no ha
+# avanzado (mismas monedas, mismo último minuto), el resultado es idéntico y
+# nos ahorramos toda la pasada de correlaciones.
+_corr_cache = {'key': None, 'results': None}
+
 def calculate_correlations(df):
-    results = []
     columns = df.columns
     THRESHOLD = 0.70 # Subimos un poco el umbral para calidad
-    
+
+    cache_key = (tuple(columns), len(df), df.index[-1])
+    if _corr_cache['key'] == cache_key:
+        print("Ventana sin cambios: reutilizando correlaciones cacheadas.")
+        return _corr_cache['results']
+
     print("Calculando matriz de correlación y lags...")
-    
-    for asset_a in columns:
-        for asset_b in columns:
-            if asset_a == asset_b: continue
-            
-            best_corr = 0
-            best_lag = 0
-            
-            # Buscamos quién mueve a quién en una ventana de +/- 15 minutos
-            for lag in range(-15, 16):
-                if lag == 0: continue # Ignoramos movimiento instantáneo exacto para buscar causalidad
-                
-                # Si desplazamos B hacia el futuro (lag negativo) y correlaciona con A hoy,
-                # significa que A se movió ANTES que B. A lidera.
-                df_shifted = df[asset_b].shift(-lag) 
-                corr = df[asset_a].corr(df_shifted)
-                
-                if pd.isna(corr): continue
-                if abs(corr) > abs(best_corr):
-                    best_corr = corr
-                    best_lag = lag
-            
-            # Filtramos solo correlaciones fuertes
-            if abs(best_corr) > THRESHOLD:
-                results.append({
-                    'leader': asset_a,
-                    'follower': asset_b,
-                    'correlation': float(best_corr),
-                    'lag_minutes': int(best_lag)
-                })
+
+    # VECTORIZADO: en vez de recalcular corr() serie a serie para cada par y
+    # cada lag (miles de llamadas a pandas), normalizamos las columnas una sola
+    # vez (z-score) y resolvemos cada lag con UNA multiplicación de matrices
+    # que cubre todos los pares a la vez. Mismo resultado, sin bucle de pandas.
+    # float32 es precisión de sobra para un coeficiente de correlación y
+    # reduce a la mitad los bytes que mueve cada GEMM (ruta SGEMM de BLAS).
+    X = df.to_numpy(dtype=np.float32)
+    N, K = X.shape
+    sd = X.std(axis=0)
+    sd[sd == 0] = 1.0 # Columnas planas: evitamos división por cero (corr = 0)
+    # Media/std se calculan UNA vez por columna; Z queda contigua en C para
+    # que los GEMM de abajo trabajen sobre un buffer plano sin strides raros.
+    Z = np.ascontiguousarray((X - X.mean(axis=0)) / sd, dtype=np.float32)
+
+    # Buscamos quién mueve a quién en una ventana de +/- 15 minutos
+    # (lag 0 excluido: ignoramos movimiento instantáneo exacto para buscar causalidad)
+    MAX_LAG = 15
+    pos_lags = np.arange(1, MAX_LAG + 1)
+    lags = np.concatenate([-pos_lags[::-1], pos_lags])
+    C = np.zeros((len(lags), K, K), dtype=np.float32)
+
+    # Solo multiplicamos los lags positivos: corr(A_t, B_t+k) == corr(B_t, A_t-k),
+    # así que la matriz del lag negativo es la transpuesta de la del positivo.
+    # Esto deja 15 GEMMs en lugar de 30 para cubrir toda la ventana.
+    for i, k in enumerate(pos_lags):
+        # C[idx][a][b] = corr(A_t, B_t+lag). Si la correlación es mejor con
+        # lag positivo, A se movió ANTES que B. A lidera.
+        c_pos = Z[:-k].T @ Z[k:] / (N - k)
+        C[MAX_LAG + i] = c_pos          # lag = +k
+        C[MAX_LAG - 1 - i] = c_pos.T    # lag = -k
+
+    # Mejor lag por par: argmax sobre el eje de lags en valor absoluto
+    best_idx = np.abs(C).argmax(axis=0)
+    best_corr = np.take_along_axis(C, best_idx[None, :, :], axis=0)[0]
+    best_lag = lags[best_idx]
+
+    # Descartamos la diagonal (a == a) y filtramos solo correlaciones fuertes
+    np.fill_diagonal(best_corr, 0.0)
+    strong_i, strong_j = np.where(np.abs(best_corr) > THRESHOLD)
+
+    # Solo materializamos los pares supervivientes (una comprehension corta),
+    # nunca los K*K diccionarios posibles.
+    results = [{
+        'leader': columns[i],
+        'follower': columns[j],
+        'correlation': float(best_corr[i, j]),
+        'lag_minutes': int(best_lag[i, j])
+    } for i, j in zip(strong_i, strong_j)]
+
+    _corr_cache['key'] = cache_key
+    _corr_cache['results'] = results
     return results
 
 def update_neptune(relationships, metadata):
@@ -127,114 +306,110 @@ def update_neptune(relationships, metadata):
         return
 
     print(f"Conectando a Neptune: {NEPTUNE_ENDPOINT}")
-    g_client = None
     try:
-        g_client = client.Client(f'wss://{NEPTUNE_ENDPOINT}:8182/gremlin', 'g')
-        
+        g_client = get_gremlin_client()
+
+        # BATCHING: cada submit().all().result() bloquea un round-trip completo
+        # al cluster. Lanzamos las queries de cada fase con submitAsync para
+        # solapar los RTT y esperamos los futuros al final de la fase.
+
         # 1. ACTUALIZAR VÉRTICES CON METADATA (Volatilidad y Volumen)
         # Esto es clave: Ahora el grafo sabe si la moneda es volátil o tiene volumen.
         unique_coins = set(metadata.keys())
-        
+
+        # Un único timestamp para toda la pasada: evita re-formatear la fecha
+        # por cada query y deja todas las escrituras con la misma marca.
+        now_iso = datetime.now().isoformat()
+
+        vertex_payload = []
         for coin in unique_coins:
             meta = metadata.get(coin, {'volatility': 0, 'volume_ratio': 0})
-            
-            # Upsert del vértice con propiedades nuevas
-            g_client.submit(f"""
-            g.V().has('coin', 'symbol', '{coin}')
-             .fold().coalesce(
-                unfold()
-                .property('volatility', {meta['volatility']})
-                .property('volume_ratio', {meta['volume_ratio']})
-                .property('last_seen', '{datetime.now().isoformat()}'), 
-                addV('coin')
-                .property('symbol', '{coin}')
-                .property('volatility', {meta['volatility']})
-                .property('volume_ratio', {meta['volume_ratio']})
-                .property('last_seen', '{datetime.now().isoformat()}')
-             )
-            """).all().result()
-            
-        # 2. INSERTAR ARISTAS (Relaciones Líder -> Seguidor)
-        for rel in relationships:
-            # Borrar relación vieja para no duplicar fuerza
-            drop_query = f"""
-            g.V().has('coin', 'symbol', '{rel['leader']}')
-             .outE('leads').where(inV().has('coin', 'symbol', '{rel['follower']}')).drop()
-            """
-            g_client.submit(drop_query).all().result()
-            
-            # Crear nueva relación
-            add_query = f"""
-            g.V().has('coin', 'symbol', '{rel['leader']}').as('a')
-             .V().has('coin', 'symbol', '{rel['follower']}').as('b')
-             .addE('leads').from('a').to('b')
-             .property('correlation', {rel['correlation']})
-             .property('lag', {rel['lag_minutes']})
-             .property('updated_at', '{datetime.now().isoformat()}')
-            """
-            g_client.submit(add_query).all().result()
+            vertex_payload.append({
+                'sym': coin,
+                'vol': meta['volatility'],
+                'vr': meta['volume_ratio'],
+                'ts': now_iso
+            })
+
+        # Upsert de vértices por lotes
+        vertex_futures = [g_client.submitAsync(VERTEX_UPSERT_QUERY, {'batch': chunk})
+                          for chunk in _batches(vertex_payload)]
+
+        # Los vértices deben existir antes de crear aristas
+        for f in vertex_futures:
+            f.result().all().result()
+
+        # 2. UPSERT DE ARISTAS (Relaciones Líder -> Seguidor)
+        edge_payload = [{
+            'leader': rel['leader'],
+            'follower': rel['follower'],
+            'corr': rel['correlation'],
+            'lag': rel['lag_minutes'],
+            'ts': now_iso
+        } for rel in relationships]
+
+        edge_futures = [g_client.submitAsync(EDGE_UPSERT_QUERY, {'batch': chunk})
+                        for chunk in _batches(edge_payload)]
+        for f in edge_futures:
+            f.result().all().result()
 
     except Exception as e:
         print(f"ERROR NEPTUNE UPDATE: {e}")
-    finally:
-        if g_client: g_client.close()
+        # Conexión posiblemente rota: forzamos reconexión en la próxima llamada
+        reset_gremlin_client()
 
 def get_leaders_analytics():
     """
     Consulta avanzada a Neptune para extraer inteligencia de mercado.
     """
     print("--- CONSULTANDO ANALÍTICAS AVANZADAS EN NEPTUNE ---")
-    g_client = None
     leaders_data = []
-    
+
     try:
-        g_client = client.Client(f'wss://{NEPTUNE_ENDPOINT}:8182/gremlin', 'g')
-        
+        g_client = get_gremlin_client()
+
         # QUERY AVANZADA:
         # 1. Busca nodos que tienen aristas salientes ('leads')
         # 2. Proyecta sus datos de mercado (volatilidad, volumen)
         # 3. Calcula su 'influence_score' (OutDegree)
         # 4. Calcula su 'independence_score' (InDegree - si es 0, nadie lo manda)
+        # 5. Agrega en el servidor: dedup de seguidores, media de |corr| y de
+        #    lag. Antes viajaba la lista completa y se agregaba en Python;
+        #    ahora solo cruzan los escalares más la lista corta para el string.
         query = """
-        g.V().where(outE('leads')).project('leader', 'volatility', 'volume_ratio', 'influence_score', 'independence_score', 'followers_info')
+        g.V().where(outE('leads')).project('leader', 'volatility', 'volume_ratio', 'influence_score', 'independence_score', 'follower_count', 'avg_correlation', 'avg_lag', 'followers_info')
          .by('symbol')
          .by(coalesce(values('volatility'), constant(0.0)))
          .by(coalesce(values('volume_ratio'), constant(0.0)))
          .by(outE('leads').count())
          .by(inE('leads').count())
-         .by(outE('leads').project('symbol', 'corr', 'lag')
+         .by(out('leads').dedup().count())
+         .by(outE('leads').values('correlation').math('abs(_)').mean())
+         .by(outE('leads').values('lag').mean())
+         .by(outE('leads').dedup().by(inV()).project('symbol', 'corr')
              .by(inV().values('symbol'))
              .by('correlation')
-             .by('lag')
              .fold())
         """
-        
+
         results = g_client.submit(query).all().result()
         timestamp = datetime.now().isoformat()
-        
+
         for r in results:
             leader = r['leader']
             volatility = r['volatility']
             vol_ratio = r['volume_ratio']
             influence = r['influence_score'] # A cuántos lidero
             independence = r['independence_score'] # Cuántos me lideran a mí (Menor es mejor para un líder puro)
-            
-            followers_raw = r['followers_info']
-            
-            # Deduplicación lógica en Python
-            unique_followers_dict = {}
-            for f in followers_raw:
-                unique_followers_dict[f['symbol']] = f
-            followers_clean = list(unique_followers_dict.values())
-            
-            count = len(followers_clean)
+
+            count = r['follower_count']
             if count == 0: continue
 
-            # Cálculos de grupo
-            avg_corr = sum([abs(f['corr']) for f in followers_clean]) / count
-            avg_lag = sum([f['lag'] for f in followers_clean]) / count
-            
-            followers_str = "; ".join([f"{f['symbol']}({f['corr']:.2f})" for f in followers_clean])
+            # Medias ya calculadas por Neptune
+            avg_corr = r['avg_correlation']
+            avg_lag = r['avg_lag']
+
+            followers_str = "; ".join([f"{f['symbol']}({f['corr']:.2f})" for f in r['followers_info']])
             
             # Lógica de "Calidad de Líder"
             # Un buen líder tiene alta influencia (mueve a muchos) y alta independencia (nadie lo mueve a él)
@@ -260,9 +435,8 @@ def get_leaders_analytics():
             
     except Exception as e:
         print(f"Error consultando líderes: {e}")
-    finally:
-        if g_client: g_client.close()
-        
+        reset_gremlin_client()
+
     return pd.DataFrame(leaders_data)
 
 def update_csv_in_s3(new_df):
@@ -270,13 +444,15 @@ def update_csv_in_s3(new_df):
         print("No hay datos para guardar.")
         return
 
-    s3 = boto3.client('s3')
-    
     try:
         print(f"Buscando archivo histórico: {CSV_FILENAME}")
         try:
             obj = s3.get_object(Bucket=S3_BUCKET, Key=f"output/{CSV_FILENAME}")
-            existing_df = pd.read_csv(obj['Body'])
+            body = obj['Body'].read()
+            # El histórico se sube comprimido (ContentEncoding gzip)
+            if obj.get('ContentEncoding') == 'gzip':
+                body = gzip.decompress(body)
+            existing_df = pd.read_csv(BytesIO(body))
             # Concatenar
             combined_df = pd.concat([existing_df, new_df], ignore_index=True)
             
@@ -292,13 +468,22 @@ def update_csv_in_s3(new_df):
         print(f"Error gestionando S3: {e}")
         combined_df = new_df
 
-    csv_buffer = StringIO()
-    combined_df.to_csv(csv_buffer, index=False)
-    
-    s3.put_object(
-        Bucket=S3_BUCKET,
-        Key=f"output/{CSV_FILENAME}",
-        Body=csv_buffer.getvalue()
+    # Comprimimos el cuerpo: el CSV de texto se reduce ~5-10x, menos bytes
+    # hacia S3 y menos descarga para el Lambda de señales. Escribimos el gzip
+    # directamente en un buffer de bytes y lo subimos en streaming, sin pasar
+    # por el str intermedio de StringIO + getvalue().
+    csv_buffer = BytesIO()
+    combined_df.to_csv(csv_buffer, index=False,
+                       compression={'method': 'gzip', 'compresslevel': 1})
+    csv_buffer.seek(0)
+
+    s3.upload_fileobj(
+        csv_buffer, S3_BUCKET, f"output/{CSV_FILENAME}",
+        ExtraArgs={'ContentEncoding': 'gzip', 'ContentType': 'text/csv'},
+        # Multipart por encima de 5MB: el histórico comprimido normalmente va
+        # en un solo PUT, pero si crece se trocea sin retener todo en memoria.
+        Config=TransferConfig(multipart_threshold=5 * 1024 * 1024,
+                              multipart_chunksize=5 * 1024 * 1024)
     )
     print(f"CSV actualizado. Filas totales: {len(combined_df)}")
 
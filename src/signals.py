@@ -1,146 +1,190 @@
 import os
+import gzip
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import pandas as pd
 import numpy as np
-from io import StringIO
+from io import BytesIO
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
 
 # Configuración
 SIGNALS_BUCKET = os.environ.get('SIGNALS_BUCKET')
 INPUT_BUCKET = os.environ.get('INPUT_BUCKET')
 CSV_OUTPUT_NAME = "trading_signals.csv"
 DEFAULT_INPUT_KEY = "output/market_leaders_history.csv"
+MAX_HISTORY_ROWS = 3000  # Limpieza para no saturar disco
 
-s3 = boto3.client('s3')
+# Pool de conexiones amplio y keep-alive TCP: en invocaciones calientes
+# reutilizamos la conexión TLS con S3 en vez de renegociar el handshake.
+s3 = boto3.client('s3', config=Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=10,
+    retries={'mode': 'adaptive'}
+))
+
+# Esquema conocido del histórico: declarar los dtypes evita la pasada de
+# inferencia de read_csv. Los numéricos se quedan en float64: en float32 un
+# 1.2 del CSV se reimprime como 1.2000000476837158 en descripciones y salida.
+INPUT_DTYPES = {
+    'leader': 'string',
+    'followers_list': 'string',
+    # Pocos valores distintos (ALPHA/STRONG/WEAK): diccionario-codificado
+    'leader_quality': 'category',
+    'avg_correlation': 'float64',
+    'avg_lag_minutes': 'float64',
+    'volatility_score': 'float64',
+    'volume_momentum': 'float64',
+}
 
 def get_latest_data(bucket, key):
     print(f"--- Leyendo archivo: s3://{bucket}/{key} ---")
     try:
         response = s3.get_object(Bucket=bucket, Key=key)
-        return pd.read_csv(response['Body'])
+        body = response['Body'].read()
+        # El pipeline del grafo sube el histórico comprimido
+        if response.get('ContentEncoding') == 'gzip':
+            body = gzip.decompress(body)
+        return pd.read_csv(BytesIO(body), dtype=INPUT_DTYPES)
     except Exception as e:
         print(f"Error leyendo S3: {e}")
         return pd.DataFrame()
 
-def detect_strategies(row):
-    """
-    Analiza una fila y genera señales.
-    """
-    signals = []
-    
-    leader = row['leader']
-    corr = row['avg_correlation']
-    lag = row['avg_lag_minutes']
-    followers_count = row['follower_count']
-    followers_str = row['followers_list']
-    timestamp = row['timestamp']
-    
-    # Obtener datos enriquecidos (con seguridad por si faltan columnas)
-    quality = row['leader_quality'] if 'leader_quality' in row else 'WEAK'
-    volatility = float(row['volatility_score']) if 'volatility_score' in row and not pd.isna(row['volatility_score']) else 0.0
-    volume_mom = float(row['volume_momentum']) if 'volume_momentum' in row and not pd.isna(row['volume_momentum']) else 1.0
-
-    # --- ESTRATEGIA 1: ALPHA PREDATOR ---
-    if quality == 'ALPHA' and volume_mom > 1.1:
-        signals.append({
-            'strategy': 'ALPHA_PREDATOR',
-            'signal_strength': 'CRITICAL',
-            'description': f"ALPHA Leader {leader} moving with Volume ({volume_mom}x).",
-            'action_asset': leader,
-            'trade_asset': 'FOLLOWERS_AGGRESSIVE',
-            'condition': 'Immediate Entry'
-        })
-
-    # --- ESTRATEGIA 2: VOLATILITY BREAKOUT ---
-    if volatility > 0.4 and lag > 0.1 and corr > 0.6:
-        signals.append({
-            'strategy': 'VOL_BREAKOUT',
-            'signal_strength': 'HIGH',
-            'description': f"{leader} High Volatility ({volatility:.2f}%) breakout.",
-            'action_asset': leader,
-            'trade_asset': 'FOLLOWERS',
-            'condition': 'Breakout Catch'
-        })
-
-    # --- ESTRATEGIA 3: LEADER MOMENTUM (Relajado) ---
-    if lag > 0.15 and corr > 0.55:
-        signals.append({
-            'strategy': 'LEADER_MOMENTUM',
-            'signal_strength': 'MEDIUM',
-            'description': f"Standard lead: {leader} is {lag}m ahead.",
-            'action_asset': leader,
-            'trade_asset': 'FOLLOWERS', 
-            'condition': 'Scalp'
-        })
-
-    # --- ESTRATEGIA 4: VOLUME LOADING ---
-    if volume_mom > 2.0 and abs(lag) < 0.5:
-        signals.append({
-            'strategy': 'VOLUME_LOADING',
-            'signal_strength': 'HIGH',
-            'description': f"High Volume ({volume_mom}x) on {leader} preparing move.",
-            'action_asset': leader,
-            'trade_asset': leader,
-            'condition': 'Anticipate'
-        })
-
-    # --- ESTRATEGIA 5: LAG CATCH-UP ---
-    if lag < -1.0 and corr > 0.60:
-        signals.append({
-            'strategy': 'LAG_CATCHUP',
-            'signal_strength': 'MEDIUM',
-            'description': f"{leader} lagging behind group.",
-            'action_asset': 'FOLLOWERS', 
-            'trade_asset': leader, 
-            'condition': 'Reversion'
-        })
-
-    # Formatear salida
-    final_output = []
-    for s in signals:
-        s.update({
-            'generated_at': datetime.now().isoformat(),
-            'data_timestamp': timestamp,
-            'leader_symbol': leader,
-            'leader_quality': quality,
-            'volatility': volatility,
-            'volume_ratio': volume_mom
-        })
-        final_output.append(s)
-        
-    return final_output
-
 def process_signals(df):
-    if df.empty: 
+    if df.empty:
         print("DataFrame vacío.")
         return pd.DataFrame()
-    
-    # Asegurar orden cronológico y tomar último snapshot
+
+    # Tomar último snapshot: el máximo es una pasada O(N), sin necesidad
+    # de ordenar (y reubicar) el histórico completo.
     if 'timestamp' in df.columns:
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df = df.sort_values('timestamp')
-        last_timestamp = df['timestamp'].iloc[-1].isoformat()
-        current_market_state = df[df['timestamp'] == df['timestamp'].iloc[-1]]
+        ts = pd.to_datetime(df['timestamp'])
+        last_ts = ts.max()
+        last_timestamp = last_ts.isoformat()
+        snapshot_mask = (ts == last_ts).to_numpy()
+        current_market_state = df[snapshot_mask]
+        data_ts = ts.to_numpy()[snapshot_mask]
     else:
         # Fallback si el CSV está corrupto o es muy simple
         last_timestamp = datetime.now().isoformat()
         current_market_state = df
-    
-    all_signals = []
-    
-    # 1. Procesar todas las filas
-    for _, row in current_market_state.iterrows():
-        row_signals = detect_strategies(row)
-        all_signals.extend(row_signals)
-        
-    # 2. LOGICA DE SEGURIDAD: Si no hay señales, generar LOG para CSV
-    if not all_signals:
+        data_ts = np.full(len(df), last_timestamp, dtype=object)
+
+    # VECTORIZADO: las estrategias ahora son máscaras booleanas sobre el
+    # snapshot completo en vez de comparaciones fila a fila con iterrows.
+    # Normalizamos el snapshot una sola vez (columna presente, sin NaN) y
+    # el resto del código lee las columnas sin comprobaciones:
+    cms = current_market_state
+    for col, default in (('leader_quality', 'WEAK'),
+                         ('volatility_score', 0.0),
+                         ('volume_momentum', 1.0)):
+        if col not in cms.columns:
+            cms = cms.assign(**{col: default})
+        elif cms[col].isna().any():
+            serie = cms[col]
+            if isinstance(serie.dtype, pd.CategoricalDtype) and default not in serie.cat.categories:
+                serie = serie.cat.add_categories([default])
+            cms = cms.assign(**{col: serie.fillna(default)})
+
+    q = cms['leader_quality']
+    if isinstance(q.dtype, pd.CategoricalDtype):
+        # Comparación por códigos enteros en vez de string a string
+        cats = q.cat.categories
+        alpha_mask = q.cat.codes.to_numpy() == (cats.get_loc('ALPHA') if 'ALPHA' in cats else -2)
+        quality = q.astype(object).to_numpy()
+    else:
+        quality = q.to_numpy()
+        alpha_mask = quality == 'ALPHA'
+
+    volatility = cms['volatility_score'].astype(float).to_numpy()
+    volume_mom = cms['volume_momentum'].astype(float).to_numpy()
+
+    leader = cms['leader'].to_numpy()
+    corr = cms['avg_correlation'].astype(float).to_numpy()
+    lag = cms['avg_lag_minutes'].astype(float).to_numpy()
+
+    # Un único timestamp de generación para todo el lote
+    generated_at = datetime.now().isoformat()
+
+    signal_frames = []
+
+    def emit(mask, strategy, strength, descriptions, action_asset, trade_asset, condition):
+        if not mask.any():
+            return
+        signal_frames.append(pd.DataFrame({
+            'strategy': strategy,
+            'signal_strength': strength,
+            'description': descriptions,
+            'action_asset': action_asset,
+            'trade_asset': trade_asset,
+            'condition': condition,
+            'generated_at': generated_at,
+            'data_timestamp': data_ts[mask],
+            'leader_symbol': leader[mask],
+            'leader_quality': quality[mask],
+            'volatility': volatility[mask],
+            'volume_ratio': volume_mom[mask]
+        }))
+
+    # ATAJO DE MERCADO TRANQUILO: si ninguna fila cumple siquiera una
+    # condición necesaria de alguna estrategia, no hay nada que evaluar.
+    may_fire = (volume_mom > 1.1) | (volatility > 0.4) | (corr > 0.55) | (lag < -1.0)
+    if may_fire.any():
+        # PREFILTRO: las estrategias sólo se evalúan sobre las filas
+        # candidatas; las tranquilas (normalmente la mayoría) salen aquí.
+        if not may_fire.all():
+            idx = np.flatnonzero(may_fire)
+            leader = leader[idx]
+            quality = quality[idx]
+            alpha_mask = alpha_mask[idx]
+            volatility = volatility[idx]
+            volume_mom = volume_mom[idx]
+            corr = corr[idx]
+            lag = lag[idx]
+            data_ts = data_ts[idx]
+
+        # --- ESTRATEGIA 1: ALPHA PREDATOR ---
+        m1 = alpha_mask & (volume_mom > 1.1)
+        emit(m1, 'ALPHA_PREDATOR', 'CRITICAL',
+             [f"ALPHA Leader {l} moving with Volume ({v}x)." for l, v in zip(leader[m1], volume_mom[m1])],
+             leader[m1], 'FOLLOWERS_AGGRESSIVE', 'Immediate Entry')
+
+        # --- ESTRATEGIA 2: VOLATILITY BREAKOUT ---
+        m2 = (volatility > 0.4) & (lag > 0.1) & (corr > 0.6)
+        emit(m2, 'VOL_BREAKOUT', 'HIGH',
+             [f"{l} High Volatility ({v:.2f}%) breakout." for l, v in zip(leader[m2], volatility[m2])],
+             leader[m2], 'FOLLOWERS', 'Breakout Catch')
+
+        # --- ESTRATEGIA 3: LEADER MOMENTUM (Relajado) ---
+        m3 = (lag > 0.15) & (corr > 0.55)
+        emit(m3, 'LEADER_MOMENTUM', 'MEDIUM',
+             [f"Standard lead: {l} is {g}m ahead." for l, g in zip(leader[m3], lag[m3])],
+             leader[m3], 'FOLLOWERS', 'Scalp')
+
+        # --- ESTRATEGIA 4: VOLUME LOADING ---
+        m4 = (volume_mom > 2.0) & (np.abs(lag) < 0.5)
+        emit(m4, 'VOLUME_LOADING', 'HIGH',
+             [f"High Volume ({v}x) on {l} preparing move." for l, v in zip(leader[m4], volume_mom[m4])],
+             leader[m4], leader[m4], 'Anticipate')
+
+        # --- ESTRATEGIA 5: LAG CATCH-UP ---
+        m5 = (lag < -1.0) & (corr > 0.60)
+        emit(m5, 'LAG_CATCHUP', 'MEDIUM',
+             [f"{l} lagging behind group." for l in leader[m5]],
+             'FOLLOWERS', leader[m5], 'Reversion')
+
+    # LOGICA DE SEGURIDAD: Si no hay señales, generar LOG para CSV
+    if not signal_frames:
         print("⚠️ No se detectaron estrategias activas. Generando fila de control.")
-        all_signals.append({
-            'generated_at': datetime.now().isoformat(),
+        return pd.DataFrame([{
+            'generated_at': generated_at,
             'data_timestamp': last_timestamp,
             'leader_symbol': 'NONE',
-            'strategy': 'NO_SIGNALS_DETECTED', 
+            'strategy': 'NO_SIGNALS_DETECTED',
             'signal_strength': 'INFO',
             'description': 'Market analyzed successfully but no patterns met thresholds.',
             'action_asset': '-',
@@ -149,39 +193,100 @@ def process_signals(df):
             'leader_quality': '-',
             'volatility': 0.0,
             'volume_ratio': 0.0
-        })
-        
-    return pd.DataFrame(all_signals)
+        }])
 
-def update_signals_csv(new_signals_df):
-    # Sin condiciones: SIEMPRE intenta escribir
+    return pd.concat(signal_frames, ignore_index=True)
+
+# Cache del histórico entre invocaciones calientes: si el ETag del objeto no
+# cambió desde nuestra última escritura, evitamos la descarga y el parseo.
+# El /tmp persiste entre invocaciones aunque el módulo se reimporte, así que
+# también guardamos ahí una copia en pickle para rehidratar la cache.
+_history_cache = {'etag': None, 'df': None}
+HISTORY_CACHE_FILE = '/tmp/trading_signals_history.pkl'
+
+def _rehydrate_history_cache():
+    if _history_cache['df'] is not None or not os.path.exists(HISTORY_CACHE_FILE):
+        return
     try:
-        print(f"Buscando histórico en {SIGNALS_BUCKET}...")
-        try:
-            obj = s3.get_object(Bucket=SIGNALS_BUCKET, Key=CSV_OUTPUT_NAME)
-            existing_df = pd.read_csv(obj['Body'])
-            combined_df = pd.concat([existing_df, new_signals_df], ignore_index=True)
-            
-            # Limpieza para no saturar disco
-            if len(combined_df) > 3000:
-                 combined_df = combined_df.tail(3000)
-        except s3.exceptions.NoSuchKey:
+        cached = pd.read_pickle(HISTORY_CACHE_FILE)
+        _history_cache['etag'] = cached['etag']
+        _history_cache['df'] = cached['df']
+        print("Cache de histórico rehidratada desde /tmp.")
+    except Exception as e:
+        print(f"No se pudo rehidratar la cache de /tmp: {e}")
+
+def load_history():
+    # Devuelve el histórico existente, o None si no hay (o falla la lectura)
+    print(f"Buscando histórico en {SIGNALS_BUCKET}...")
+    try:
+        _rehydrate_history_cache()
+        head = s3.head_object(Bucket=SIGNALS_BUCKET, Key=CSV_OUTPUT_NAME)
+        if _history_cache['df'] is not None and head.get('ETag') == _history_cache['etag']:
+            print("Histórico sin cambios (ETag): usando copia en memoria.")
+            return _history_cache['df']
+        obj = s3.get_object(Bucket=SIGNALS_BUCKET, Key=CSV_OUTPUT_NAME)
+        raw = obj['Body'].read()
+        if obj.get('ContentEncoding') == 'gzip':
+            raw = gzip.decompress(raw)
+        return pd.read_csv(BytesIO(raw))
+    except ClientError as e:
+        # head_object devuelve un ClientError genérico con código 404 cuando
+        # el objeto no existe (NoSuchKey sólo lo modela get_object)
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
             print("Archivo no existe. Creando nuevo.")
-            combined_df = new_signals_df
-        except Exception as e:
+        else:
             print(f"Error leyendo histórico (creando nuevo): {e}")
+        return None
+    except Exception as e:
+        print(f"Error leyendo histórico (creando nuevo): {e}")
+        return None
+
+# Centinela: distingue "no me pasaron histórico" de "no hay histórico"
+_NO_HISTORY_GIVEN = object()
+
+def update_signals_csv(new_signals_df, existing_df=_NO_HISTORY_GIVEN):
+    # Sin condiciones: SIEMPRE intenta escribir
+    try:
+        if existing_df is _NO_HISTORY_GIVEN:
+            existing_df = load_history()
+
+        if existing_df is not None:
+            # Recortamos ANTES de concatenar: así no copiamos filas que el
+            # límite del histórico va a descartar de inmediato.
+            keep = MAX_HISTORY_ROWS - len(new_signals_df)
+            if len(existing_df) > keep:
+                existing_df = existing_df.iloc[-keep:] if keep > 0 else existing_df.iloc[0:0]
+            combined_df = pd.concat([existing_df, new_signals_df], ignore_index=True)
+        else:
             combined_df = new_signals_df
 
-        csv_buffer = StringIO()
-        combined_df.to_csv(csv_buffer, index=False)
-        
-        s3.put_object(
+        # Serializamos directo a gzip en un buffer de bytes: evita
+        # materializar el CSV como str intermedio antes de comprimir.
+        csv_buffer = BytesIO()
+        combined_df.to_csv(csv_buffer, index=False,
+                           compression={'method': 'gzip', 'compresslevel': 1})
+
+        put_resp = s3.put_object(
             Bucket=SIGNALS_BUCKET,
             Key=CSV_OUTPUT_NAME,
-            Body=csv_buffer.getvalue()
+            Body=csv_buffer.getvalue(),
+            ContentEncoding='gzip',
+            ContentType='text/csv',
+            # CRC32C por hardware en vez del MD5 por defecto para la integridad
+            ChecksumAlgorithm='CRC32C'
         )
+
+        # Recordamos lo que acabamos de subir: la próxima invocación caliente
+        # compara el ETag con un head_object y se salta el GET completo.
+        _history_cache['etag'] = put_resp.get('ETag')
+        _history_cache['df'] = combined_df
+        try:
+            pd.to_pickle({'etag': _history_cache['etag'], 'df': combined_df},
+                         HISTORY_CACHE_FILE)
+        except Exception as e:
+            print(f"No se pudo guardar la cache en /tmp: {e}")
         print(f"¡ÉXITO! CSV actualizado con {len(new_signals_df)} filas nuevas.")
-        
+
     except Exception as e:
         print(f"ERROR CRÍTICO escribiendo en S3: {e}")
 
@@ -189,34 +294,43 @@ def handler(event, context):
     print("--- INICIO ANÁLISIS ---")
     
     # 1. DETERMINAR ORIGEN DE DATOS (Solución al KeyError)
-    src_bucket = INPUT_BUCKET
-    src_key = DEFAULT_INPUT_KEY
-    
-    try:
-        # Verificamos si viene de un trigger S3 real
-        if event and 'Records' in event and len(event['Records']) > 0:
-            if 's3' in event['Records'][0]:
-                src_bucket = event['Records'][0]['s3']['bucket']['name']
-                src_key = event['Records'][0]['s3']['object']['key']
-                print(f"Trigger S3 detectado: {src_key}")
-        else:
-            print("Trigger manual o desconocido. Usando bucket/key por defecto.")
-    except Exception as e:
-        print(f"Advertencia analizando evento: {e}. Usando defaults.")
+    # Verificamos si viene de un trigger S3 real (sin try/except: con .get()
+    # el caso normal no paga maquinaria de excepciones). Un evento puede
+    # traer varios Records (lotes): los procesamos todos en una invocación.
+    sources = []
+    for record in (event or {}).get('Records') or []:
+        s3_info = record.get('s3')
+        if s3_info:
+            src_bucket = s3_info.get('bucket', {}).get('name', INPUT_BUCKET)
+            # Las keys en eventos S3 vienen URL-encoded (espacios, etc.)
+            src_key = unquote_plus(s3_info.get('object', {}).get('key', DEFAULT_INPUT_KEY))
+            sources.append((src_bucket, src_key))
+
+    if sources:
+        print(f"Trigger S3 detectado: {len(sources)} objeto(s): {[k for _, k in sources]}")
+    else:
+        print("Trigger manual o desconocido. Usando bucket/key por defecto.")
+        sources = [(INPUT_BUCKET, DEFAULT_INPUT_KEY)]
 
     # 2. PROCESO PRINCIPAL
     try:
-        df_history = get_latest_data(src_bucket, src_key)
-        
-        if df_history.empty:
-            print("El CSV de entrada está vacío. No se puede procesar.")
-            return {"statusCode": 200, "body": "Input Empty"}
+        # El GET del histórico es independiente de los de entrada: todo se
+        # descarga en paralelo y el histórico llega mientras procesamos.
+        with ThreadPoolExecutor(max_workers=min(len(sources), 8) + 1) as executor:
+            history_future = executor.submit(load_history)
 
-        # Procesar (Esto ahora siempre devuelve un DataFrame, aunque sea con NO_SIGNALS)
-        signals_df = process_signals(df_history)
-        
-        # Guardar (Esto escribe incondicionalmente)
-        update_signals_csv(signals_df)
+            frames = [df for df in executor.map(lambda src: get_latest_data(*src), sources)
+                      if not df.empty]
+            if not frames:
+                print("El CSV de entrada está vacío. No se puede procesar.")
+                return {"statusCode": 200, "body": "Input Empty"}
+            df_history = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+            # Procesar (Esto ahora siempre devuelve un DataFrame, aunque sea con NO_SIGNALS)
+            signals_df = process_signals(df_history)
+
+            # Guardar (Esto escribe incondicionalmente)
+            update_signals_csv(signals_df, existing_df=history_future.result())
             
     except Exception as e:
         print(f"ERROR FATAL: {e}")